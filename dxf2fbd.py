@@ -73,6 +73,8 @@ def main(args):
         help="path to output file (default: standard output)",
     )
     args = opts.parse_args(args)
+    if not (args.tolerance > 0 and math.isfinite(args.tolerance)):
+        opts.error("the tolerance must be a finite number larger than 0")
     logging.basicConfig(
         level=getattr(logging, args.log.upper(), None),
         format="# %(levelname)s: %(message)s",
@@ -99,7 +101,7 @@ def load(name, tolerance):
         tolerance (float): minimum distance between distinct coordinates.
 
     Returns:
-        points: list of 2-tuples of coordinate strings.
+        points: list of 2-tuples of float coordinates.
         lines: list of 2-tuples of indices (start, end) into the points list.
         arcs: list of 3-tuples of indices (start, end, center) into the points list.
         splines: list of n-tuples indices (start, end, ...) into the points list.
@@ -110,14 +112,24 @@ def load(name, tolerance):
         Determine if the given pnt is in the points list.
         If not add it to the list.
         Return the index of pnt in points.
+
+        Points are hashed on the grid cell that contains them. The cells are
+        twice as large as the tolerance, so a point within tolerance of pnt
+        must be in the same or a neighboring cell, even with rounding errors.
+        Only those 3×3 cells have to be searched.
         """
-        for n, (a, b) in enumerate(points):
-            if (
-                abs(float(a) - pnt[0]) < tolerance
-                and abs(float(b) - pnt[1]) < tolerance
-            ):
-                return n
+        kx, ky = math.floor(pnt[0] / cell), math.floor(pnt[1] / cell)
+        found = [
+            n
+            for dx, dy in it.product((-1, 0, 1), repeat=2)
+            for n in point_hash.get((kx + dx, ky + dy), ())
+            if abs(points[n][0] - pnt[0]) < tolerance
+            and abs(points[n][1] - pnt[1]) < tolerance
+        ]
+        if found:
+            return min(found)
         points.append(pnt)
+        point_hash.setdefault((kx, ky), []).append(len(points) - 1)
         return len(points) - 1
 
     ents = entities(parse(name))
@@ -125,17 +137,19 @@ def load(name, tolerance):
     if len(contours) == 0:
         logging.error("no entities in layer “contour”: nothing to do")
         sys.exit(1)
-    unknown = set(bycode(e, 0) for e in contours) - {
-        "ARC",
-        "LINE",
-        "LWPOLYLINE",
-        "ELLIPSE",
-    }
+    # Sort the entities by type in one pass. Within a type, the order of the
+    # entities in the file is kept.
+    bytype = co.defaultdict(list)
+    for e in contours:
+        bytype[bycode(e, 0)].append(e)
+    unknown = bytype.keys() - {"ARC", "LINE", "LWPOLYLINE", "ELLIPSE"}
     for u in unknown:
         logging.warning(f"entities of type “{u}” will be ignored.")
     points = []  # list of (y,z) coordinates
+    point_hash = {}  # maps grid cells to indices into points.
+    cell = 2 * tolerance  # size of the grid cells.
     lines = []  # list of 2-tuples of indexes into the points list.
-    for ln in [e for e in contours if bycode(e, 0) == "LINE"]:
+    for ln in bytype["LINE"]:
         startidx = pntidx((float(bycode(ln, 10)), float(bycode(ln, 20))))
         endidx = pntidx((float(bycode(ln, 11)), float(bycode(ln, 21))))
         if startidx != endidx:
@@ -145,7 +159,7 @@ def load(name, tolerance):
                 f"0-length line from {points[startidx]} to {points[endidx]} ignored"
             )
     arcs = []
-    for arc in [e for e in contours if bycode(e, 0) == "ARC"]:
+    for arc in bytype["ARC"]:
         center = (float(bycode(arc, 10)), float(bycode(arc, 20)))
         cenidx = pntidx(center)
         radius = bycode(arc, 40)
@@ -169,7 +183,7 @@ def load(name, tolerance):
                 f"malformed arc from {points[startidx]} to {points[endidx]},"
                 f" center {points[cenidx]} ignored"
             )
-    for lwp in [e for e in contours if bycode(e, 0) == "LWPOLYLINE"]:
+    for lwp in bytype["LWPOLYLINE"]:
         xvals = (float(j) for j in bycode(lwp, 10))
         yvals = (float(j) for j in bycode(lwp, 20))
         lwpix = [pntidx((x, y)) for x, y in zip(xvals, yvals)]
@@ -185,7 +199,7 @@ def load(name, tolerance):
     # We need ≥7 segments in 90° to make a decent elliptical arc.
     segment_angle = math.pi / (2 * 7)
     # Generate splines to represent an elliptical arc.
-    for ell in [e for e in contours if bycode(e, 0) == "ELLIPSE"]:
+    for ell in bytype["ELLIPSE"]:
         cx, cy = float(bycode(ell, 10)), float(bycode(ell, 20))
         dx, dy = float(bycode(ell, 11)), float(bycode(ell, 21))
         a = math.sqrt(dx**2 + dy**2)
@@ -201,15 +215,24 @@ def load(name, tolerance):
         if arc < EPS:
             logging.info(f"very small ellipse (arc < {EPS}) ignored")
             continue
-        segments = math.ceil(arc / segment_angle)
+        # Use at least two segments, so that even a short arc has a point
+        # between its start and end.
+        segments = max(2, math.ceil(arc / segment_angle))
         da = arc / segments
-        angles = (j * da + start for j in range(segments + 1))
-        spoints = ((a * math.cos(t), b * math.sin(t)) for t in angles)
-        # transform to global coordinates
-        spoints = (
-            (x * cosφ - y * sinφ + cx, x * sinφ + y * cosφ + cy) for x, y in spoints
-        )
-        indices = [pntidx((x, y)) for x, y in spoints]
+        # Fold the ellipse axes and the rotation to global coordinates into
+        # one transformation matrix, so each point costs one cos and sin.
+        m11, m12, m21, m22 = a * cosφ, -b * sinφ, a * sinφ, b * cosφ
+        indices = []
+        for j in range(segments + 1):
+            t = j * da + start
+            ct, st = math.cos(t), math.sin(t)
+            indices.append(pntidx((m11 * ct + m12 * st + cx, m21 * ct + m22 * st + cy)))
+        # Consecutive points can coincide within the tolerance for small
+        # ellipses. Those would generate degenerate splines.
+        indices = [k for k, _ in it.groupby(indices)]
+        if len(indices) < 3:
+            logging.info(f"degenerate ellipse with center ({cx},{cy}) ignored")
+            continue
         last = indices[-1]
         indices = indices[:-1]
         indices.insert(1, last)
@@ -236,16 +259,30 @@ def surfaces(lines, arcs, splines):
     # geom has to be built up in the same sequence here as lines, arcs and
     # splines are handled below in write_fbd!
     geom = lines + [a[:2] for a in arcs] + [s[:2] for s in splines]
-    # find closed loops of 4 entities
-    rv = []
-    for length in (3, 4, 5):
-        for comb in it.combinations(geom, length):
-            # Count how often each point occurs
-            c = co.Counter(it.chain(*comb))
-            # For a closed loop, all points should occur exactly twice.
-            if all(j == 2 for j in c.values()):
-                rv.append(tuple(geom.index(ln) + 1 for ln in comb))
-    return rv
+    # Map each point to the edges connected to it.
+    adj = co.defaultdict(list)
+    for n, (a, b) in enumerate(geom):
+        adj[a].append((n, b))
+        adj[b].append((n, a))
+    # Walk the graph starting from every edge to find closed loops. Only edges
+    # with a higher index than the starting edge are followed, so that every
+    # loop is only found from its lowest-numbered edge.
+    found = set()
+    for e0, (start, first) in enumerate(geom):
+        stack = [(first, (e0,), {start, first})]
+        while stack:
+            pnt, path, visited = stack.pop()
+            for n, other in adj[pnt]:
+                if n <= e0 or n in path:
+                    continue
+                if other == start:
+                    if len(path) >= 2:
+                        found.add(tuple(sorted(path + (n,))))
+                elif len(path) < 4 and other not in visited:
+                    stack.append((other, path + (n,), visited | {other}))
+    # Return the loops ordered by length and edge numbers.
+    rv = sorted(found, key=lambda loop: (len(loop), loop))
+    return [tuple(n + 1 for n in loop) for loop in rv]
 
 
 def write_fbd(stream, points, lines, arcs, splines, path, scale):
@@ -254,70 +291,77 @@ def write_fbd(stream, points, lines, arcs, splines, path, scale):
 
     Arguments:
         stream: file to write to.
-        points: list of 2-tuples of coordinate strings.
+        points: list of 2-tuples of float coordinates.
         lines: list of 2-tuples of indices (start, end) into the points list.
         arcs: list of 3-tuples of indices (start, end, center) into the points list.
         splines: list of n-tuples indices (start, end, ...) into the points list.
         path: path to the original DXF file.
         scale: factor to scale DXF coordinates with.
     """
+    # Collect the output and write it in one go.
+    parts = []
     # Header
-    stream.write("# Generated by dxf2inp.py\n")
-    stream.write(f"# from “{path}”\n")
-    stream.write("# on " + str(datetime.datetime.now())[:-7] + "\n")
-
-    stream.write("\n# Points extracted from DXF\n")
-    pprec = math.floor(math.log10(len(points))) + 1
-    for n, p in enumerate(points, start=1):
-        stream.write(f"pnt P{n:0{pprec}d} 0.0 {p[0]*scale:.7f} {p[1]*scale:.7f}\n")
+    parts.append("# Generated by dxf2inp.py\n")
+    parts.append(f"# from “{path}”\n")
+    parts.append("# on " + str(datetime.datetime.now())[:-7] + "\n")
+
+    parts.append("\n# Points extracted from DXF\n")
+    pprec = len(str(len(points)))
+    pfmt = f"pnt P{{:0{pprec}d}} 0.0 {{:.7f}} {{:.7f}}\n"
+    parts.extend(
+        pfmt.format(n, p[0] * scale, p[1] * scale)
+        for n, p in enumerate(points, start=1)
+    )
 
-    lprec = math.floor(math.log10(len(lines) + len(arcs) + len(splines))) + 1
+    lprec = len(str(len(lines) + len(arcs) + len(splines)))
+    # Format templates for line and point names.
+    lname = f"L{{:0{lprec}d}}"
+    pname = f"P{{:0{pprec}d}}"
 
     if lines:
-        stream.write("\n# Lines extracted from DXF\n")
-        for n, ln in enumerate(lines, start=1):
-            stream.write(
-                f"line L{n:0{lprec}d} P{ln[0]+1:0{pprec}d} P{ln[1]+1:0{pprec}d} \n"
-            )
+        parts.append("\n# Lines extracted from DXF\n")
+        lfmt = f"line {lname} {pname} {pname} \n"
+        parts.extend(
+            lfmt.format(n, ln[0] + 1, ln[1] + 1) for n, ln in enumerate(lines, start=1)
+        )
 
     if arcs:
-        stream.write("\n# Arcs extracted from DXF\n")
-        for n, ln in enumerate(arcs, start=len(lines) + 1):
-            stream.write(
-                f"line L{n:0{lprec}d} P{ln[0]+1:0{pprec}d} "
-                f"P{ln[1]+1:0{pprec}d} P{ln[2]+1:0{pprec}d} \n"
-            )
+        parts.append("\n# Arcs extracted from DXF\n")
+        afmt = f"line {lname} {pname} {pname} {pname} \n"
+        parts.extend(
+            afmt.format(n, ln[0] + 1, ln[1] + 1, ln[2] + 1)
+            for n, ln in enumerate(arcs, start=len(lines) + 1)
+        )
 
     if splines:
-        stream.write("\n# Ellipes/splines extracted from DXF\n")
+        parts.append("\n# Ellipes/splines extracted from DXF\n")
+        qfmt = f"seqa Q{{:0{lprec}d}} pnt {{}}\n"
+        splfmt = f"line {lname} {pname} {pname} Q{{:0{lprec}d}} \n"
         for n, sp in enumerate(splines, start=len(lines) + len(arcs) + 1):
-            cps = [f"P{k+1:0{pprec}d}" for k in sp[2:]]
-            sstr = f"seqa Q{n:0{lprec}d} pnt " + " ".join(cps) + "\n"
-            stream.write(sstr)
-            stream.write(
-                f"line L{n:0{lprec}d} P{sp[0]+1:0{pprec}d} P{sp[1]+1:0{pprec}d} "
-                + f"Q{n:0{lprec}d} \n"
-            )
+            cps = " ".join(pname.format(k + 1) for k in sp[2:])
+            parts.append(qfmt.format(n, cps))
+            parts.append(splfmt.format(n, sp[0] + 1, sp[1] + 1, n))
 
     surf = surfaces(lines, arcs, splines)
     if surf:
-        sprec = math.floor(math.log10(len(surf))) + 1
-        stream.write("\n# Detected surfaces\n")
+        sprec = len(str(len(surf)))
+        sfmt = f"surf S{{:0{sprec}d}} blend"
+        parts.append("\n# Detected surfaces\n")
         for n, s in enumerate(surf, start=1):
-            stream.write(f"surf S{n:0{sprec}d} blend")
-            for ln in s:
-                stream.write(f" L{ln:0{lprec}d}")
-            stream.write("\n")
+            parts.append(sfmt.format(n))
+            parts.extend(" " + lname.format(ln) for ln in s)
+            parts.append("\n")
 
     # Footer
-    stream.write("# End of extracted data.\n")
-    stream.write("\n# Show geometry up to now\n")
-    stream.write("plot pa all\n")
-    stream.write("plus la all\n")
-    stream.write("plus sa all\n")
-    stream.write("rot y\n")
-    stream.write("rot r 90\n")
-    stream.write("break\n")
+    parts.append("# End of extracted data.\n")
+    parts.append("\n# Show geometry up to now\n")
+    parts.append("plot pa all\n")
+    parts.append("plus la all\n")
+    parts.append("plus sa all\n")
+    parts.append("rot y\n")
+    parts.append("rot r 90\n")
+    parts.append("break\n")
+    stream.write("".join(parts))
 
 
 def parse(filename):
@@ -331,10 +375,8 @@ def parse(filename):
         A list of (group, data) tuples.
     """
     with open(filename, encoding="cp1252") as dxffile:
-        lines = dxffile.readlines()
-    lines = [ln.strip() for ln in lines]
-    data = list(zip(lines[::2], lines[1::2]))
-    return [(int(g), d) for g, d in data]
+        # Zipping the file with itself yields pairs of consecutive lines.
+        return [(int(g), d.strip()) for g, d in zip(dxffile, dxffile)]
 
 
 def entities(data):
@@ -348,14 +390,22 @@ def entities(data):
         A list of drawing entities, each as a dictionary
         keyed by group code.
     """
-    soe = [n for n, d in enumerate(data) if d[1] == "ENTITIES"][0]
-    eoe = [n for n, d in enumerate(data) if d[1] == "ENDSEC" and n > soe][0]
-    entdata = data[soe + 1 : eoe]
-    idx = [n for n, d in enumerate(entdata) if d[0] == 0] + [len(entdata)]
-    pairs = list(zip(idx, idx[1:]))
-    # NOTE: don't use a dict for entities! Some entities like LWPOLYLINE
-    # have multiple groups 10 and 20.
-    entities = [tuple(entdata[b:e]) for b, e in pairs]
+    # Collect the entities in a single pass over the data.
+    inside, ent, entities = False, None, []
+    for g, d in data:
+        if not inside:
+            inside = d == "ENTITIES"
+            continue
+        if d == "ENDSEC":
+            break
+        if g == 0:
+            ent = {}
+            entities.append(ent)
+        if ent is not None:
+            ent.setdefault(g, []).append(d)
+    # NOTE: Some entities like LWPOLYLINE have multiple groups 10 and 20.
+    # Only those are kept as a list.
+    entities = [{k: v[0] if len(v) == 1 else v for k, v in e.items()} for e in entities]
     return entities
 
 
@@ -364,22 +414,19 @@ def bycode(ent, group):
     Get the data with the given group code from an entity.
 
     Arguments:
-        ent: An iterable of (group, data) tuples.
+        ent: A dictionary containing a DXF entity.
         group: Group code that you want to retrieve.
 
     Returns:
         The data for the given group code. Can be a list of items if the group
         code occurs multiple times.
     """
-    data = [v for k, v in ent if k == group]
-    if len(data) == 1:
-        return data[0]
-    return data
+    return ent.get(group, [])
 
 
 def layername(ent):
     """Get the layer name of an entity."""
-    return [v for k, v in ent if k == 8][0]
+    return ent[8]
 
 
 def fromlayer(entities, name):